@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''Stochastic simulation of the DNA replication timing in S phase.
+Usage:
+    ./dna_replication.py n_cells
+
+Origins are placed at random positions along each chromosome with the
+mammalian mean inter-origin distance. Each origin fires at a random
+time unless a fork from a neighboring origin replicates it first.
+Forks move in both directions at the replication fork speed.
+
+The time at which position x is replicated is
+    T(x) = min_i(t_i + |x - x_i| / v)
+where x_i and t_i are the positions and firing times of the origins.
+Passively replicated origins never contribute to the minimum, so the
+whole chromosome is solved with two cumulative minimum passes over the
+sorted origins instead of stepping the forks through time. The S phase
+is complete when the last position of the last chromosome is replicated.
+'''
+
+import os
+import sys
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from basic_bio_numbers import basic_bio_numbers
+
+
+def replication_completion_times(n_cells, chromosome_sizes, fork_speed, inter_origin_distance, mean_firing_time, rng=np.random):
+    '''Simulate the replication of the chromosomes of n_cells cells at once.
+
+    Args:
+        chromosome_sizes : Array of the sizes of the chromosomes in kb
+        fork_speed : Speed of a fork in kb/min
+        inter_origin_distance : Mean distance between origins in kb
+        mean_firing_time : Mean of the exponentially distributed firing times in min
+
+    Return:
+        A tuple (completion_times, n_fired_origins) of arrays with one value per cell.
+        The times are in min.
+    '''
+    sizes = np.asarray(chromosome_sizes, dtype=float)[np.newaxis, :, np.newaxis]
+    n_origins = rng.poisson(sizes[..., 0] / inter_origin_distance, (n_cells, sizes.shape[1]))
+
+    # Pad the origins of each chromosome to the same number. The pads never fire
+    # and sit at the ends of the chromosome, so that the replication of the ends
+    # is the same as the meeting of a fork with a pad.
+
+    max_origins = n_origins.max()
+    padded = np.arange(max_origins) >= n_origins[..., np.newaxis]
+
+    x = np.sort(np.where(padded, sizes, rng.uniform(size=(n_cells, sizes.shape[1], max_origins)) * sizes), axis=-1)
+    t = np.where(padded, np.inf, rng.exponential(mean_firing_time, x.shape))
+
+    x = np.concatenate([np.zeros(x.shape[:2] + (1,)), x, np.broadcast_to(sizes, x.shape[:2] + (1,))], axis=-1)
+    t = np.concatenate([np.full(t.shape[:2] + (1,), np.inf), t, np.full(t.shape[:2] + (1,), np.inf)], axis=-1)
+
+    # Replication times of the origin positions from the forks coming from the left and right
+
+    from_left = np.minimum.accumulate(t - x / fork_speed, axis=-1) + x / fork_speed
+    from_right = np.minimum.accumulate((t + x / fork_speed)[..., ::-1], axis=-1)[..., ::-1] - x / fork_speed
+    T = np.minimum(from_left, from_right)
+
+    # The forks between two neighboring origins meet at the latest time in the gap
+
+    meeting_times = (T[..., :-1] + T[..., 1:] + np.diff(x, axis=-1) / fork_speed) / 2
+    completion_times = meeting_times.max(axis=(1, 2))
+
+    # An origin fires if it is not replicated before its firing time. Allow for
+    # the round-off of adding and subtracting x / v in the cumulative minimums.
+
+    n_fired_origins = np.sum(np.isfinite(t) & (t <= T + 1E-6), axis=(1, 2))
+
+    return completion_times, n_fired_origins
+
+def simulate_chunk(args):
+    n_cells, seed, kwargs = args
+    return replication_completion_times(n_cells, rng=np.random.default_rng(seed), **kwargs)
+
+def simulate_s_phase(n_cells, n_chromosomes=23, chromosome_size=basic_bio_numbers['mean_human_chromosome_size'],
+        fork_speed=basic_bio_numbers['dna_replication'], inter_origin_distance=basic_bio_numbers['mammals_mean_inter_ORI_inverval_length'],
+        mean_firing_time=120, max_chunk_elements=10000000, n_processes=None, seed=0):
+    '''Simulate the S phase of n_cells cells with chromosomes of the
+    same size. The cells are simulated in chunks so that each chunk
+    has at most about max_chunk_elements origins, and the chunks are
+    run on a process pool. Each chunk has its own random seed derived
+    from seed, so the results do not depend on the number of processes.
+
+    Return a tuple (completion_times, n_fired_origins) of arrays with one value per cell.
+    '''
+    kwargs = {'chromosome_sizes': np.full(n_chromosomes, chromosome_size), 'fork_speed': fork_speed,
+            'inter_origin_distance': inter_origin_distance, 'mean_firing_time': mean_firing_time}
+
+    origins_per_cell = n_chromosomes * chromosome_size / inter_origin_distance
+    chunk_size = max(int(max_chunk_elements // origins_per_cell), 1)
+
+    chunks = [min(chunk_size, n_cells - start) for start in range(0, n_cells, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(n, s, kwargs) for n, s in zip(chunks, seeds)]
+
+    if n_processes == 1:
+        results = [simulate_chunk(t) for t in tasks]
+    else:
+        with multiprocessing.Pool(n_processes) as pool:
+            results = pool.map(simulate_chunk, tasks)
+
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+if __name__ == '__main__':
+    n_cells = 2000 if len(sys.argv) < 2 else int(sys.argv[1])
+
+    print('Replication of a human genome of 23 chromosomes of {0} kb, fork speed = {1} kb/min, inter-origin distance = {2} kb'.format(
+        basic_bio_numbers['mean_human_chromosome_size'], basic_bio_numbers['dna_replication'],
+        basic_bio_numbers['mammals_mean_inter_ORI_inverval_length']))
+
+    # If all the origins fired at once, the replication would be limited by the largest gap
+
+    for mean_firing_time in [0.01, 120, 480]:
+        completion_times, n_fired_origins = simulate_s_phase(n_cells, mean_firing_time=mean_firing_time)
+        print('mean firing time = {0} min: S phase = {1:.0f} +- {2:.0f} min (5%-95%: {3:.0f}-{4:.0f} min), fired origins = {5:.0f}, HeLa S phase = {6} min'.format(
+            mean_firing_time, completion_times.mean(), completion_times.std(), np.percentile(completion_times, 5),
+            np.percentile(completion_times, 95), n_fired_origins.mean(), basic_bio_numbers['hela_s_phase_duration']))
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+'''Monte Carlo validation of the scaled particle theory crowding model.
+Usage:
+    ./hard_sphere_insertion.py n_crowders
+
+Hard sphere crowders are placed in a periodic box and equilibrated
+by Monte Carlo. The activity coefficient of a tracer is 1 / P where P
+is the probability that a tracer inserted at a random position does
+not overlap with any crowder (Widom insertion).
+
+Overlaps are found with one cell list per crowder species. A cell list
+is a dense array of (n_cells, max_occupancy) sphere indices, so that
+the queries are vectorized and the cost scales linearly with the
+number of crowders.
+'''
+
+import os
+import sys
+import itertools
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from protein_crowding import crowder_radii_and_volume_fractions, spt_log_activity_coefficient
+
+
+class CellList:
+    '''A spatial hash grid of a subset of spheres in a periodic cubic box.
+
+    The table stores the indices into the full positions array, so that
+    moves done in place are seen by the cell list as long as the spheres
+    stay in their cells. The cell size is at least the largest diameter
+    of the spheres in the list.
+    '''
+
+    def __init__(self, positions, radii, index, box_length, offset=np.zeros(3)):
+        self.positions = positions
+        self.radii = radii
+        self.index = index
+        self.max_radius = radii[index].max()
+        self.box_length = box_length
+        self.offset = offset
+
+        # Limit the number of cells so that tiny spheres do not make a huge table
+
+        self.n_cells = max(min(int(box_length // (2 * self.max_radius)), int(np.ceil(len(index) ** (1 / 3)))), 1)
+
+        # Use an even number of cells for the checkerboard Monte Carlo moves
+
+        if self.n_cells > 1:
+            self.n_cells = self.n_cells // 2 * 2
+        self.cell_size = box_length / self.n_cells
+
+        cell_ids = self.cell_ids(positions[index])
+        order = np.argsort(cell_ids, kind='stable')
+        counts = np.bincount(cell_ids, minlength=self.n_cells ** 3)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        ranks = np.arange(len(order)) - starts[cell_ids[order]]
+
+        self.counts = counts
+        self.table = -np.ones((self.n_cells ** 3, max(counts.max(), 1)), dtype=np.int64)
+        self.table[cell_ids[order], ranks] = index[order]
+
+    def cell_coordinates(self, points):
+        return np.floor((points - self.offset) % self.box_length / self.cell_size).astype(np.int64) % self.n_cells
+
+    def flat_cell_ids(self, cell_coordinates):
+        return (cell_coordinates[:, 0] * self.n_cells + cell_coordinates[:, 1]) * self.n_cells + cell_coordinates[:, 2]
+
+    def cell_ids(self, points):
+        return self.flat_cell_ids(self.cell_coordinates(points))
+
+    def overlaps(self, points, point_radii, exclude=None, chunk_size=100000):
+        '''Return a boolean array that is True for the points which
+        overlap with any sphere in the cell list. Spheres whose indices
+        are given by exclude are ignored.
+        '''
+        points = np.atleast_2d(points)
+        point_radii = np.broadcast_to(point_radii, len(points))
+        exclude = -np.ones(len(points), dtype=np.int64) if exclude is None else exclude
+        result = np.zeros(len(points), dtype=bool)
+
+        if len(points) == 0:
+            return result
+
+        n_range = min(int(np.ceil((point_radii.max() + self.max_radius) / self.cell_size)), self.n_cells // 2)
+        offsets = list(itertools.product(range(-n_range, n_range + 1), repeat=3))
+
+        for start in range(0, len(points), chunk_size):
+            # Only keep checking the points that have not overlapped yet
+
+            todo = np.arange(start, min(start + chunk_size, len(points)))
+            cells = self.cell_coordinates(points[todo])
+
+            for o in offsets:
+                candidates = self.table[self.flat_cell_ids((cells + o) % self.n_cells)]
+                valid = (candidates >= 0) & (candidates != exclude[todo, np.newaxis])
+
+                d = points[todo, np.newaxis, :] - self.positions[candidates]
+                d -= self.box_length * np.round(d / self.box_length)
+                contact = point_radii[todo, np.newaxis] + self.radii[candidates]
+
+                overlap = np.any(valid & (np.sum(d * d, axis=-1) < contact * contact), axis=1)
+                result[todo[overlap]] = True
+                todo = todo[~overlap]
+                cells = cells[~overlap]
+
+        return result
+
+def species_cell_lists(positions, radii, box_length, offset=np.zeros(3)):
+    '''Make one cell list for each sphere size.'''
+    return [CellList(positions, radii, np.flatnonzero(radii == r), box_length, offset) for r in np.unique(radii)]
+
+def any_overlaps(cell_lists, points, point_radii, exclude=None):
+    result = np.zeros(len(points), dtype=bool)
+
+    for c in cell_lists:
+        todo = np.flatnonzero(~result)
+        result[todo] = c.overlaps(points[todo], np.broadcast_to(point_radii, len(points))[todo],
+                None if exclude is None else exclude[todo])
+
+    return result
+
+def random_sequential_addition(radii, box_length, max_rounds=1000, rng=np.random):
+    '''Place spheres of the given radii at random positions without
+    overlap. The species are placed from the largest to the smallest,
+    otherwise the large spheres will not fit. In each round, all the
+    remaining spheres of a species are proposed at once and the ones
+    that overlap with placed spheres or with other proposals of the
+    same round are rejected.
+
+    Return the positions of the placed spheres and their radii.
+    Raise a ValueError if some spheres are not placed after max_rounds
+    rounds, which happens when the volume fraction is too high.
+    '''
+    positions = np.zeros((0, 3))
+    placed_radii = np.zeros(0)
+
+    for radius in np.unique(radii)[::-1]:
+        remaining = radii[radii == radius]
+        cell_lists = species_cell_lists(positions, placed_radii, box_length) if len(positions) > 0 else []
+
+        for i in range(max_rounds):
+            if len(remaining) == 0:
+                break
+
+            trials = rng.uniform(0, box_length, (len(remaining), 3))
+            accept = ~any_overlaps(cell_lists, trials, remaining)
+
+            # Reject the trials that overlap with other trials of the same round
+
+            index = np.flatnonzero(accept)
+            if len(index) > 0:
+                trial_cells = CellList(trials, remaining, index, box_length)
+                accept[index[trial_cells.overlaps(trials[index], remaining[index], exclude=index)]] = False
+
+            positions = np.concatenate([positions, trials[accept]])
+            placed_radii = np.concatenate([placed_radii, remaining[accept]])
+            remaining = remaining[~accept]
+            cell_lists = species_cell_lists(positions, placed_radii, box_length)
+
+        if len(remaining) > 0:
+            raise ValueError('Failed to place {0} of {1} spheres of radius {2} after {3} rounds. The volume fraction {4:.3f} is too high.'.format(
+                len(remaining), np.sum(radii == radius), radius, max_rounds, np.sum(4 / 3 * np.pi * radii ** 3) / box_length ** 3))
+
+    return positions, placed_radii
+
+def monte_carlo_sweep(positions, radii, box_length, max_displacement, rng=np.random):
+    '''Do one sweep of parallel hard sphere Monte Carlo moves in place.
+
+    The species are moved one after another. The grid of the species
+    is shifted by a random offset and its cells are split into 8
+    checkerboard classes. In each step, one sphere per cell of a class
+    is moved. Spheres in cells of the same class are at least one cell
+    apart, so the moves are independent. Moves that leave the cell are
+    rejected, so the cell lists stay valid during the sweep. The random
+    offset lets the spheres cross the cell borders between sweeps.
+    On average each sphere is moved once per sweep.
+
+    Return the acceptance ratio.
+    '''
+    n_accepted = 0
+    n_trials = 0
+
+    for radius in np.unique(radii):
+        offset = rng.uniform(0, box_length, 3)
+        cell_lists = species_cell_lists(positions, radii, box_length, offset)
+        cells = [c for c in cell_lists if c.radii[c.index[0]] == radius][0]
+        n = cells.n_cells
+
+        classes = []
+        for parity in itertools.product([0, 1], repeat=3):
+            grid = np.stack(np.meshgrid(*[np.arange(p, n, 2) for p in parity], indexing='ij'), axis=-1).reshape(-1, 3)
+            cell_ids = cells.flat_cell_ids(grid)
+            classes.append(cell_ids[cells.counts[cell_ids] > 0])
+
+        for i in range(int(np.ceil(len(cells.index) / np.count_nonzero(cells.counts)))):
+            for cell_ids in classes:
+                movers = cells.table[cell_ids, rng.randint(0, np.iinfo(np.int32).max, len(cell_ids)) % cells.counts[cell_ids]]
+                trials = (positions[movers] + rng.uniform(-max_displacement, max_displacement, (len(movers), 3))) % box_length
+
+                accept = cells.cell_ids(trials) == cells.cell_ids(positions[movers])
+                index = np.flatnonzero(accept)
+                accept[index] = ~any_overlaps(cell_lists, trials[index], radius, exclude=movers[index])
+
+                positions[movers[accept]] = trials[accept]
+                n_accepted += accept.sum()
+                n_trials += len(movers)
+
+    return n_accepted / max(n_trials, 1)
+
+def hard_sphere_crowders(n_crowders, crowder_radii, crowder_volume_fractions, n_sweeps=20, rng=np.random):
+    '''Make an equilibrated box of polydisperse hard spheres.
+    Return the positions, the radii and the box length.
+    '''
+    crowder_radii = np.asarray(crowder_radii, dtype=float)
+    number_fractions = np.asarray(crowder_volume_fractions) / crowder_radii ** 3
+    number_fractions /= number_fractions.sum()
+
+    radii = crowder_radii[np.repeat(np.arange(len(crowder_radii)), np.round(number_fractions * n_crowders).astype(int))]
+    box_length = (np.sum(4 / 3 * np.pi * radii ** 3) / np.sum(crowder_volume_fractions)) ** (1 / 3)
+
+    positions, radii = random_sequential_addition(radii, box_length, rng=rng)
+
+    max_displacement = radii.min()
+    for i in range(n_sweeps):
+        if monte_carlo_sweep(positions, radii, box_length, max_displacement, rng=rng) < 0.3:
+            max_displacement *= 0.8
+
+    return positions, radii, box_length
+
+def widom_log_activity_coefficient(tracer_radii, positions, radii, box_length, n_insertions=1000000, rng=np.random):
+    '''Estimate the log of the activity coefficients of the tracers
+    by random insertions. Return an array of ln(gamma) for each tracer.
+    '''
+    cell_lists = species_cell_lists(positions, radii, box_length)
+    log_gamma = []
+
+    for r in np.atleast_1d(tracer_radii):
+        free = n_insertions - any_overlaps(cell_lists, rng.uniform(0, box_length, (n_insertions, 3)), r).sum()
+        log_gamma.append(np.log(n_insertions / free) if free > 0 else np.inf)
+
+    return np.array(log_gamma)
+
+
+if __name__ == '__main__':
+    n_crowders = 20000 if len(sys.argv) < 2 else int(sys.argv[1])
+
+    # Work in nm to keep the numbers readable
+
+    crowder_radii, crowder_volume_fractions = crowder_radii_and_volume_fractions()
+    crowder_radii = crowder_radii * 1E9
+
+    positions, radii, box_length = hard_sphere_crowders(n_crowders, crowder_radii, crowder_volume_fractions)
+
+    print('Placed {0} crowders in a box of {1:.1f} nm, volume fraction = {2:.3f}'.format(
+        len(radii), box_length, np.sum(4 / 3 * np.pi * radii ** 3) / box_length ** 3))
+
+    tracer_radii = np.array([0.5, 1, 2, 3])
+    log_gamma_mc = widom_log_activity_coefficient(tracer_radii, positions, radii, box_length, n_insertions=200000)
+    log_gamma_spt = spt_log_activity_coefficient(tracer_radii, crowder_radii, crowder_volume_fractions)
+
+    for r, mc, spt in zip(tracer_radii, log_gamma_mc, log_gamma_spt):
+        print('tracer radius = {0} nm, ln(gamma) Monte Carlo = {1:.3f}, scaled particle theory = {2:.3f}'.format(r, mc, spt))
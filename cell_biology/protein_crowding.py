@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+
 import numpy as np
 import scipy.special
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'diffusion'))
+from diffusion import weight_to_radius
+
 cell_protein_concentration = 1000 * 0.3 * 0.5 / 3E4 # mol/L 
 # (total density 1kg/L) * (wet weight to dry weight) * (protein fraction of dry weight) / (average protein weight 30kDa)
 
@@ -16,6 +22,71 @@ protein_length = 5E-9 # m
 # Surface energy for water
 water_surface_energy = 0.1 # kcal / mol / Angstrom^2
 
+# Volume fraction of proteins in a cell. The density of proteins is assumed to be same to water.
+cell_protein_volume_fraction = cell_protein_concentration * 3E4 / 1000 
+# (concentration mol/L) * (average protein weight 30kDa) / (density 1000 g/L)
+
+# A rough polydisperse composition of the cytoplasm. Weights are in Dalton.
+# The mass fractions are fractions of the total protein mass.
+cytoplasm_crowders = [
+        {'crowder':'small_protein', 'weight':1E4, 'mass_fraction':0.2},
+        {'crowder':'average_protein', 'weight':3E4, 'mass_fraction':0.4},
+        {'crowder':'protein_complex', 'weight':3E5, 'mass_fraction':0.25},
+        {'crowder':'ribosome', 'weight':2.5E6, 'mass_fraction':0.15},
+        ]
+
+def crowder_radii_and_volume_fractions(crowders=cytoplasm_crowders, total_volume_fraction=cell_protein_volume_fraction):
+    '''Get the radii (m) and the volume fractions of a list of crowders.
+    The total volume fraction is distributed by the mass fractions.
+    '''
+    radii = weight_to_radius(np.array([c['weight'] for c in crowders]))
+    mass_fractions = np.array([c['mass_fraction'] for c in crowders])
+
+    return radii, total_volume_fraction * mass_fractions / mass_fractions.sum()
+
+def spt_log_activity_coefficient(tracer_radius, crowder_radii, crowder_volume_fractions):
+    '''Calculate the log of the excluded volume activity coefficient
+    of a hard sphere tracer in a mixture of hard sphere crowders
+    by the scaled particle theory.
+
+        ln(gamma) = -ln(1 - z3) + A * s + B * s^2 + C * s^3
+        zn = pi / 6 * sum_i(rho_i * sigma_i^n)
+
+    where s is the diameter of the tracer, sigma_i and rho_i are the
+    diameters and number densities of the crowders.
+
+    Args:
+        tracer_radius : Radius of the tracer. Arrays are broadcast with the
+            leading dimensions of the crowder_volume_fractions.
+        crowder_radii : Array of the radii of the k crowder species
+        crowder_volume_fractions : Array with the shape (..., k)
+
+    The radii can have any length unit.
+    '''
+    radii = np.asarray(crowder_radii, dtype=float)
+    volume_fractions = np.asarray(crowder_volume_fractions, dtype=float)
+
+    rho = volume_fractions / (4 / 3 * np.pi * radii ** 3)
+    z0, z1, z2, z3 = [np.pi / 6 * np.sum(rho * (2 * radii) ** n, axis=-1) for n in range(4)]
+
+    s = 2 * np.asarray(tracer_radius, dtype=float)
+    f = 1 - z3
+
+    return (- np.log(f) + 3 * z2 / f * s
+            + (3 * z1 / f + 9 * z2 ** 2 / (2 * f ** 2)) * s ** 2
+            + (z0 / f + 3 * z1 * z2 / f ** 2 + 3 * z2 ** 3 / f ** 3) * s ** 3)
+
+def crowding_binding_free_energy_change(radius_A, radius_B, crowder_radii, crowder_volume_fractions):
+    '''Change of the binding free energy of A + B -> AB due to crowding
+    in kcal/mol. The volume of AB is the sum of the volumes of A and B.
+    A negative value means that crowding makes the binding stronger.
+    '''
+    radius_AB = (np.asarray(radius_A) ** 3 + np.asarray(radius_B) ** 3) ** (1 / 3)
+
+    return 0.596 * (spt_log_activity_coefficient(radius_AB, crowder_radii, crowder_volume_fractions) 
+            - spt_log_activity_coefficient(radius_A, crowder_radii, crowder_volume_fractions)
+            - spt_log_activity_coefficient(radius_B, crowder_radii, crowder_volume_fractions)) #kB * T = 0.596 kcal/mol
+
 def mosaic_protein_protein_binding_model():
     '''A model that estimate the binding
     affinities between proteins.
@@ -76,3 +147,21 @@ if __name__ == '__main__':
 
 
     mosaic_protein_protein_binding_model()
+
+    radii, volume_fractions = crowder_radii_and_volume_fractions()
+
+    print('Protein volume fraction in a cell is about {0:.2f}'.format(cell_protein_volume_fraction))
+    print('Activity coefficients in the cytoplasm:')
+    for weight in [1E3, 3E4, 3E5]:
+        print('    weight = {0:.1E} Da, radius = {1:.2E} m, activity coefficient = {2:.2f}'.format(weight, weight_to_radius(weight),
+            np.exp(spt_log_activity_coefficient(weight_to_radius(weight), radii, volume_fractions))))
+
+    print('Crowding changes the binding free energy of two 30kDa proteins by {0:.2f} kcal/mol'.format(
+        crowding_binding_free_energy_change(weight_to_radius(3E4), weight_to_radius(3E4), radii, volume_fractions)))
+
+    # Evaluate the activity coefficients for many tracer sizes and crowding levels at once
+
+    tracer_radii = weight_to_radius(np.logspace(2, 7, 5000))
+    scales = np.linspace(0, 2, 1000)
+    log_gamma = spt_log_activity_coefficient(tracer_radii[:, np.newaxis], radii, scales[:, np.newaxis] * volume_fractions)
+    print('Evaluated {0} activity coefficients, max ln(gamma) = {1:.1f}'.format(log_gamma.size, log_gamma.max()))
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
+import numpy as np
 
 
 def critical_washing_volume(Kd, N_bound, Kd_competitor=None, concentration_competitor=None):
     '''Calculate the critical washing volume at which significantly
     amount of the bound molecule will be washed off.
+    The arguments can be numbers or numpy arrays.
 
     Args:
         Kd : Dissociation constant for the bound molecule in mole/L
@@ -24,4 +26,4 @@ def critical_washing_volume(Kd, N_bound, Kd_competitor=None, concentration_compe
     else:
         v_comp = (N_bound * Kd_competitor) / (Kd * concentration_competitor)
         
-        return min(V_no_comp, v_comp)
+        return np.minimum(V_no_comp, v_comp)
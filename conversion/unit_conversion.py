@@ -119,11 +119,12 @@ def unit_number_to_string(unit, unit_number):
 
     return s
 
-if __name__ == '__main__':
-    input_value = float(sys.argv[1])
-    input_unit = sys.argv[2]
-    output_unit = '' if len(sys.argv) < 4 else sys.argv[3]
+def convert(input_value, input_unit, output_unit=''):
+    '''Convert a value with the input unit to the output unit.
+    If the output unit is empty, convert to standard units.
 
+    Return a tuple (output_value, output_unit).
+    '''
     # Convert input unit to standard units
 
     input_positive_units, input_negative_units = split_unit_string_to_positive_and_negative_lists(input_unit)
@@ -138,5 +139,14 @@ if __name__ == '__main__':
 
     output_positive_units, output_negative_units = split_unit_string_to_positive_and_negative_lists(output_unit)
     output_value = to_custom_unit(value_and_units_std, output_positive_units, output_negative_units)
+
+    return output_value, output_unit
+
+if __name__ == '__main__':
+    input_value = float(sys.argv[1])
+    input_unit = sys.argv[2]
+    output_unit = '' if len(sys.argv) < 4 else sys.argv[3]
+
+    output_value, output_unit = convert(input_value, input_unit, output_unit)
     
     print('{0:.3E} {1} = {2:.3E} {3}'.format(input_value, input_unit, output_value, output_unit))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+'''Reaction diffusion of several species in a cell-sized cube.
+Usage:
+    ./reaction_diffusion.py snapshot_file
+
+The concentrations are on a 3D grid with periodic or Neumann (no flux)
+boundaries. Each time step treats the reactions explicitly and the
+diffusion implicitly in the spectral space:
+
+    c(t + dt) = F^-1[ F[c(t) + dt * R(c(t))] / (1 + dt * D * k^2) ]
+
+where F is the FFT for periodic boundaries and the type II DCT for
+Neumann boundaries. The diffusion part is stable for any dt, but dt
+should be small compared with 1 / (k_on * c) of the reactions.
+
+Concentrations are in molecules / m^3, lengths in m, times in s and
+bimolecular rate constants in m^3 / s, the same as diffusion_limited_reaction_rate.
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.fft
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cell_biology'))
+from diffusion import weight_to_radius, friction_coefficient_for_sphere, diffusion_coefficient, diffusion_limited_reaction_rate
+from basic_bio_numbers import basic_bio_numbers
+
+
+def molecule_diffusion_coefficient(weight, temperature=300):
+    '''Diffusion coefficient in m^2 / s of a spherical molecule in water
+    given the weight in Dalton.
+    '''
+    return diffusion_coefficient(friction_coefficient_for_sphere(weight_to_radius(weight)), temperature)
+
+def diffusion_limited_reaction(species, reactants, products):
+    '''Make a bimolecular reaction with the diffusion limited rate.
+    The species is a dictionary of species which have weights.
+    '''
+    w1, w2 = [species[r]['weight'] for r in reactants]
+
+    return {'reactants': reactants, 'products': products,
+            'rate': diffusion_limited_reaction_rate(molecule_diffusion_coefficient(w1), weight_to_radius(w1),
+                molecule_diffusion_coefficient(w2), weight_to_radius(w2))}
+
+class ReactionDiffusionSolver:
+    '''A semi-implicit spectral solver on an n^3 grid.
+
+    Args:
+        species : A dictionary of species. Each species is a dictionary which
+            has either the diffusion coefficient 'D' or the 'weight' in Dalton.
+        reactions : A list of reactions. Each reaction is a dictionary with
+            'reactants' (1 or 2 species names), 'products' and the 'rate'.
+        box_length : Length of the cube in m
+        grid_size : Number of grid points per dimension
+        boundary : 'periodic' or 'neumann'
+    '''
+
+    def __init__(self, species, reactions, box_length, grid_size, boundary='periodic', dtype=np.float32):
+        if not boundary in ['periodic', 'neumann']:
+            raise ValueError('Unknown boundary {0}'.format(boundary))
+
+        self.names = list(species.keys())
+        self.D = np.array([s['D'] if 'D' in s else molecule_diffusion_coefficient(s['weight']) for s in species.values()])
+        self.reactions = [([self.names.index(r) for r in reaction['reactants']],
+            [self.names.index(p) for p in reaction['products']], reaction['rate']) for reaction in reactions]
+
+        self.box_length = box_length
+        self.grid_size = grid_size
+        self.boundary = boundary
+        self.dtype = dtype
+
+        # Squared wave numbers of the spectral modes
+
+        n = grid_size
+        if boundary == 'periodic':
+            k = 2 * np.pi * np.fft.fftfreq(n, box_length / n)
+            k_last = 2 * np.pi * np.fft.rfftfreq(n, box_length / n)
+        else:
+            k = np.pi * np.arange(n) / box_length
+            k_last = k
+
+        self.k2 = (k[:, np.newaxis, np.newaxis] ** 2 + k[np.newaxis, :, np.newaxis] ** 2
+                + k_last[np.newaxis, np.newaxis, :] ** 2).astype(dtype)
+
+        self.dt = None
+        self.denominators = None
+
+    def initial_concentrations(self, **fields):
+        '''Make the concentration array of (n_species, n, n, n). Each keyword
+        argument is a number or a grid of the concentration of a species.
+        '''
+        c = np.zeros((len(self.names),) + (self.grid_size,) * 3, dtype=self.dtype)
+        for name, value in fields.items():
+            c[self.names.index(name)] = value
+
+        return c
+
+    def grid_coordinates(self):
+        '''Return the x, y, z coordinates of the grid points in m.'''
+        x = (np.arange(self.grid_size) + 0.5) * self.box_length / self.grid_size
+
+        return np.meshgrid(x, x, x, indexing='ij', sparse=True)
+
+    def reaction_rates(self, c):
+        '''Return dc/dt of the reactions.'''
+        dcdt = np.zeros_like(c)
+
+        for reactants, products, rate in self.reactions:
+            flux = rate * c[reactants[0]]
+            for r in reactants[1:]:
+                flux = flux * c[r]
+
+            for r in reactants:
+                dcdt[r] -= flux
+            for p in products:
+                dcdt[p] += flux
+
+        return dcdt
+
+    def forward(self, field):
+        if self.boundary == 'periodic':
+            return scipy.fft.rfftn(field, workers=-1)
+        return scipy.fft.dctn(field, type=2, workers=-1)
+
+    def backward(self, spectrum):
+        if self.boundary == 'periodic':
+            return scipy.fft.irfftn(spectrum, s=(self.grid_size,) * 3, workers=-1)
+        return scipy.fft.idctn(spectrum, type=2, workers=-1)
+
+    def step(self, c, dt):
+        '''Advance the concentrations in place by one time step.'''
+        if dt != self.dt:
+            self.dt = dt
+            self.denominators = [(1 + dt * D * self.k2).astype(self.dtype) for D in self.D]
+
+        c += dt * self.reaction_rates(c)
+
+        for i in range(len(self.names)):
+            spectrum = self.forward(c[i])
+            spectrum /= self.denominators[i]
+            c[i] = self.backward(spectrum)
+
+        return c
+
+    def run(self, c, dt, n_steps, snapshot_path=None, snapshot_interval=10):
+        '''Run n_steps steps. If snapshot_path is given, the concentrations
+        are written to a memory-mapped .npy file of (n_snapshots, n_species, n, n, n)
+        every snapshot_interval steps, starting from the initial state.
+
+        Return the final concentrations.
+        '''
+        snapshots = None
+        if snapshot_path is not None:
+            snapshots = np.lib.format.open_memmap(snapshot_path, mode='w+', dtype=self.dtype,
+                    shape=(n_steps // snapshot_interval + 1,) + c.shape)
+            snapshots[0] = c
+
+        for i in range(1, n_steps + 1):
+            self.step(c, dt)
+
+            if snapshots is not None and i % snapshot_interval == 0:
+                snapshots[i // snapshot_interval] = c
+                snapshots.flush()
+
+        return c
+
+def benchmark(grid_size, boundary='periodic', n_steps=5):
+    '''Return the mean time per step in s of the enzyme example on a grid.'''
+    species = {'E': {'weight': 3.1E4}, 'S': {'weight': 342}, 'P': {'weight': 342}}
+    reactions = [diffusion_limited_reaction(species, ['E', 'S'], ['E', 'P'])]
+
+    solver = ReactionDiffusionSolver(species, reactions, basic_bio_numbers['hela_cell_volume'] ** (1 / 3) * 1E-6, grid_size, boundary)
+    c = solver.initial_concentrations(E=6E20, S=6E21)
+
+    solver.step(c, 1E-5)
+    start = time.time()
+    solver.run(c, 1E-5, n_steps)
+
+    return (time.time() - start) / n_steps
+
+
+if __name__ == '__main__':
+    snapshot_file = sys.argv[1]
+
+    # An enzyme converts a substrate released at the center of a HeLa cell.
+    # 1 uM = 6.02E20 molecules / m^3
+
+    species = {'E': {'weight': 3.1E4}, 'S': {'weight': 342}, 'P': {'weight': 342}}
+    reactions = [diffusion_limited_reaction(species, ['E', 'S'], ['E', 'P'])]
+
+    box_length = basic_bio_numbers['hela_cell_volume'] ** (1 / 3) * 1E-6
+    solver = ReactionDiffusionSolver(species, reactions, box_length, 64, boundary='neumann')
+
+    x, y, z = solver.grid_coordinates()
+    r2 = (x - box_length / 2) ** 2 + (y - box_length / 2) ** 2 + (z - box_length / 2) ** 2
+    c = solver.initial_concentrations(E=6.02E20, S=6.02E22 * np.exp(-r2 / (2 * (1E-6) ** 2)))
+
+    print('Cell length = {0:.2E} m, D_E = {1:.2E} m^2/s, D_S = {2:.2E} m^2/s, k_on = {3:.2E} m^3/s'.format(
+        box_length, solver.D[0], solver.D[1], reactions[0]['rate']))
+
+    total_before = c[1:].sum()
+    c = solver.run(c, 1E-6, 100, snapshot_path=snapshot_file, snapshot_interval=10)
+    print('After 0.1 ms: substrate = {0:.3f}, product = {1:.3f} of the initial substrate, max substrate = {2:.2E} molecules/m^3'.format(
+        c[1].sum() / total_before, c[2].sum() / total_before, c[1].max()))
+    print('Snapshots of shape {0} are in {1}'.format(np.load(snapshot_file, mmap_mode='r').shape, snapshot_file))
+
+    print('\nTime per step with 3 species:')
+    for grid_size in [128, 256]:
+        for boundary in ['periodic', 'neumann']:
+            print('    {0}^3 grid, {1} boundary: {2:.3f} s'.format(grid_size, boundary, benchmark(grid_size, boundary)))
@@ -12,23 +12,47 @@ import numpy as np
 
 
 def calc_pH(pKa, concentration):
-    '''Calculate pH from pKa of a molecule and its concentration.'''
+    '''Calculate pH from pKa of a molecule and its concentration.
+
+    The pKa and the concentration can be numbers or numpy arrays.
+    Return None for a number or nan in an array if there is no
+    physically meaningful solution.
+    '''
     Kw = 10 ** (-14)
+    pKa, concentration = np.broadcast_arrays(np.asarray(pKa, dtype=float), np.asarray(concentration, dtype=float))
     Kd = 10 ** (-pKa)
 
-    coeff = [1, Kd, - Kd * concentration - Kw, -Kd * Kw]
-    roots = np.roots(coeff)
+    # The roots of x^3 + Kd x^2 + (- Kd * concentration - Kw) x - Kd * Kw
+    # are the eigenvalues of the companion matrices, the same as np.roots
+
+    companion = np.zeros(pKa.shape + (3, 3))
+    companion[..., 0, 0] = - Kd
+    companion[..., 0, 1] = Kd * concentration + Kw
+    companion[..., 0, 2] = Kd * Kw
+    companion[..., 1, 0] = 1
+    companion[..., 2, 1] = 1
+
+    roots = np.linalg.eigvals(companion)
+
+    # Find the first physically meaningful root
+
+    root = np.real(roots)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        excess = root - Kw / root
+
+    meaningful = ((np.imag(roots) == 0) & (root >= 0) & (excess >= -1E-20)
+            & (excess <= concentration[..., np.newaxis]))
 
-    # Find the physically meaningful root
+    found = np.any(meaningful, axis=-1)
+    root = np.take_along_axis(root, np.argmax(meaningful, axis=-1)[..., np.newaxis], axis=-1)[..., 0]
 
-    real_roots = [np.real(r) for r in roots if np.imag(r) == 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pH = np.where(found, -np.log10(root), np.nan)
 
-    for root in real_roots:
-        if root < 0: continue
-        if root - Kw / root < -1E-20: continue
-        if root - Kw / root > concentration: continue
+    if pH.ndim == 0:
+        return pH[()] if found else None
 
-        return -np.log10(root)
+    return pH
 
 if __name__ == '__main__':
     pKa = float(sys.argv[1])
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+'''Run a model function over a grid of parameters.
+
+Every grid point has a 64 bit key computed from its parameter values.
+The results are cached in a store directory, in a subdirectory named by
+a hash of the source of the module that defines the function and of
+the fixed arguments, so results of an old version of a function or of
+its module constants are never reused. Array arguments are hashed by
+their dtype, shape and data, numbers and strings by their repr.
+
+A sweep only evaluates the grid points whose keys are not in the cache.
+The new points are split into chunks, each chunk is evaluated with a
+single vectorized call on a process pool and saved as soon as it is
+done. An interrupted sweep resumes from the saved chunks, and adding
+values to an axis of a finished sweep only evaluates the new points.
+
+Usage:
+    ./parameter_sweep.py store_directory
+'''
+
+import os
+import sys
+import glob
+import hashlib
+import inspect
+import multiprocessing
+
+import numpy as np
+
+
+def parameter_grid(**axes):
+    '''Make the full grid of the given parameter axes.
+    Each keyword argument is a list of values for one parameter.
+
+    Return a dictionary of flat arrays which all have the
+    length of the product of the axis lengths.
+    '''
+    names = list(axes.keys())
+    meshes = np.meshgrid(*[np.asarray(axes[n]) for n in names], indexing='ij')
+
+    return {n: m.ravel() for n, m in zip(names, meshes)}
+
+def function_fingerprint(function):
+    '''Return a string that changes when the function, the helpers and
+    constants of its module, or the function name change.
+    '''
+    try:
+        source = inspect.getsource(inspect.getmodule(function))
+    except (OSError, TypeError):
+        try:
+            source = inspect.getsource(function)
+        except (OSError, TypeError):
+            source = ''
+
+    return '{0}.{1}\n{2}'.format(function.__module__, function.__qualname__, source)
+
+def cache_directory(function, fixed_kwargs, store_directory):
+    '''The directory of the cached results of a function and fixed arguments.'''
+    md5 = hashlib.md5(function_fingerprint(function).encode())
+
+    # The repr of a long numpy array is shortened with '...', so hash the data of arrays
+
+    for name in sorted(fixed_kwargs.keys()):
+        value = fixed_kwargs[name]
+        md5.update(repr(name).encode())
+
+        if isinstance(value, (np.ndarray, list, tuple)):
+            array = np.asarray(value)
+            md5.update('{0}{1}'.format(array.dtype.str, array.shape).encode())
+            md5.update(array.tobytes())
+        else:
+            md5.update(repr(value).encode())
+
+    return os.path.join(store_directory, '{0}_{1}'.format(function.__name__, md5.hexdigest()))
+
+def grid_point_keys(grid):
+    '''Hash the parameter values of each grid point to a 64 bit key.
+    The values are compared as float64, and the parameter names are
+    part of the key.
+    '''
+    n_points = len(next(iter(grid.values())))
+    keys = np.full(n_points, np.uint64(0xcbf29ce484222325))
+
+    for name in sorted(grid.keys()):
+        name_bits = np.uint64(int(hashlib.md5(name.encode()).hexdigest()[:16], 16))
+        bits = np.ascontiguousarray(grid[name], dtype=np.float64).view(np.uint64)
+
+        keys = (keys ^ name_bits) * np.uint64(0x100000001b3)
+        keys = (keys ^ bits) * np.uint64(0x100000001b3)
+
+    # Finalize with the splitmix64 mixer so that similar points get unrelated keys
+
+    keys = (keys ^ (keys >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    keys = (keys ^ (keys >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+
+    return keys ^ (keys >> np.uint64(31))
+
+def load_cache(directory):
+    '''Return the sorted keys and the results of all the saved chunks.'''
+    keys = []
+    results = []
+
+    for key_file in sorted(glob.glob(os.path.join(directory, '*.keys.npy'))):
+        keys.append(np.load(key_file))
+        results.append(np.load(key_file[:-len('.keys.npy')] + '.results.npy'))
+
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0)
+
+    keys = np.concatenate(keys)
+    results = np.concatenate(results)
+    order = np.argsort(keys)
+
+    return keys[order], results[order]
+
+def evaluate_chunk(args):
+    '''Evaluate the function on one chunk and save the keys and the results.
+    Functions that do not accept arrays are evaluated point by point.
+    '''
+    function, chunk, keys, fixed_kwargs, vectorized, directory = args
+
+    if vectorized:
+        result = function(**chunk, **fixed_kwargs)
+    else:
+        result = np.vectorize(lambda **kw: function(**kw, **fixed_kwargs))(**chunk)
+
+    result = np.broadcast_to(np.asarray(result, dtype=float), len(keys))
+
+    # The results are written before the keys and both are written to temporary
+    # files first, so that a crash never leaves keys without their results
+
+    path = os.path.join(directory, hashlib.md5(keys.tobytes()).hexdigest())
+
+    for suffix, array in [('.results.npy', result), ('.keys.npy', keys)]:
+        np.save(path + suffix + '.tmp.npy', array)
+        os.replace(path + suffix + '.tmp.npy', path + suffix)
+
+    return len(keys)
+
+def run_sweep(function, grid, store_directory, chunk_size=10000, n_processes=None,
+        vectorized=True, **fixed_kwargs):
+    '''Evaluate function over a grid made by parameter_grid.
+
+    Args:
+        function : A module level function of this repository
+        grid : A dictionary of flat parameter arrays
+        store_directory : The directory where the results are cached
+        chunk_size : Number of new grid points per chunk
+        n_processes : Number of worker processes. Run in the current process if 1
+        vectorized : If the function accepts numpy arrays
+        fixed_kwargs : Other arguments passed to every call
+
+    Return:
+        An array of the results in the order of the grid points
+    '''
+    directory = cache_directory(function, fixed_kwargs, store_directory)
+    os.makedirs(directory, exist_ok=True)
+
+    keys = grid_point_keys(grid)
+    cached_keys, _ = load_cache(directory)
+
+    # Evaluate each new point once even if it appears several times in the grid
+
+    new_keys, new_index = np.unique(keys, return_index=True)
+    is_new = ~np.isin(new_keys, cached_keys)
+    new_keys, new_index = new_keys[is_new], new_index[is_new]
+
+    todo = [(function, {n: v[new_index[start:start + chunk_size]] for n, v in grid.items()},
+        new_keys[start:start + chunk_size], fixed_kwargs, vectorized, directory)
+        for start in range(0, len(new_keys), chunk_size)]
+
+    if len(todo) > 0:
+        if n_processes == 1:
+            for args in todo:
+                evaluate_chunk(args)
+        else:
+            with multiprocessing.Pool(n_processes) as pool:
+                for _ in pool.imap_unordered(evaluate_chunk, todo):
+                    pass
+
+    return load_sweep(function, grid, store_directory, **fixed_kwargs)
+
+def load_sweep(function, grid, store_directory, **fixed_kwargs):
+    '''Load the cached results of function over a grid.
+    Raise a KeyError if some grid points have not been evaluated.
+    '''
+    cached_keys, cached_results = load_cache(cache_directory(function, fixed_kwargs, store_directory))
+    keys = grid_point_keys(grid)
+
+    if len(cached_keys) == 0:
+        raise KeyError('No grid points have been evaluated.')
+
+    index = np.minimum(np.searchsorted(cached_keys, keys), len(cached_keys) - 1)
+    found = cached_keys[index] == keys
+
+    if not np.all(found):
+        raise KeyError('{0} of {1} grid points have not been evaluated.'.format(np.sum(~found), len(keys)))
+
+    return cached_results[index]
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'statistical_and_molecular_mechanics'))
+    from molecular_mechanics import debye_length
+
+    store_directory = sys.argv[1]
+
+    grid = parameter_grid(z=[1, 2, 3], n=np.logspace(-6, 0, 1000), T=np.linspace(280, 320, 41), epsilon=[5, 40, 80])
+    lengths = run_sweep(debye_length, grid, store_directory, chunk_size=50000)
+
+    print('Evaluated the Debye length at {0} grid points in {1}'.format(len(lengths), store_directory))
+    print('The Debye length ranges from {0:.3E} m to {1:.3E} m'.format(lengths.min(), lengths.max()))
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+'''A local HTTP/JSON service for the estimators in this repository.
+Usage:
+    ./calculation_service.py port
+    ./calculation_service.py unix_socket_path
+
+Call a function by posting its keyword arguments as a JSON object:
+    curl -d '{"pKa": 4.76, "concentration": 0.1}' localhost:8000/calc_pH
+
+Concurrent requests to the same function are collected for a short
+time window and evaluated together in a worker thread, so that the
+event loop keeps serving other requests. Functions that accept numpy
+arrays are called once for the whole batch. A batched call gives the
+same results as separate calls: only requests whose arguments are all
+numbers are batched, and elements that fail or are not finite are
+evaluated again one by one. GET /metrics returns the request
+counts and latencies of each endpoint.
+'''
+
+import os
+import sys
+import json
+import time
+import asyncio
+import collections
+
+import numpy as np
+
+repo_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+for d in ['pH', 'conversion', 'diffusion', 'chromatography', 'centrifuge', 'statistical_and_molecular_mechanics']:
+    sys.path.insert(0, os.path.join(repo_directory, d))
+
+from pKa_concentration_to_pH import calc_pH
+from unit_conversion import convert
+from diffusion import weight_to_radius, friction_coefficient_for_sphere, diffusion_coefficient, diffusion_limited_reaction_rate
+from chromatography import critical_washing_volume
+from centrifuge import boltzmann_decay_length
+from molecular_mechanics import coulomb_potential, debye_length
+
+
+# Each endpoint is a tuple (function, vectorized). Vectorized functions
+# are evaluated once per batch with numpy arrays as arguments.
+endpoint_functions = {
+        'calc_pH' : (calc_pH, True),
+        'convert' : (convert, False),
+        'critical_washing_volume' : (critical_washing_volume, True),
+
+        'weight_to_radius' : (weight_to_radius, True),
+        'friction_coefficient_for_sphere' : (friction_coefficient_for_sphere, True),
+        'diffusion_coefficient' : (diffusion_coefficient, True),
+        'diffusion_limited_reaction_rate' : (diffusion_limited_reaction_rate, True),
+        'boltzmann_decay_length' : (boltzmann_decay_length, True),
+        'coulomb_potential' : (coulomb_potential, True),
+        'debye_length' : (debye_length, True),
+        }
+
+http_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+def to_json_value(value):
+    '''Convert the return value of a function to a JSON compatible value.'''
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, tuple):
+        return [to_json_value(v) for v in value]
+
+    return value
+
+def is_number(value):
+    '''If a JSON value is an int or a float. Bools are not numbers.'''
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class Endpoint:
+    '''Collect the requests to a function into batches.'''
+
+    def __init__(self, function, vectorized, batch_window=0.002, max_batch_size=4096, max_queue_size=65536):
+        self.function = function
+        self.vectorized = vectorized
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.queue = asyncio.Queue(max_queue_size)
+
+        self.n_requests = 0
+        self.n_rejected = 0
+        self.n_errors = 0
+        self.n_batches = 0
+        self.latencies = collections.deque(maxlen=10000)
+
+    async def call(self, kwargs):
+        '''Queue a call and wait for the result.
+        Raise asyncio.QueueFull if the endpoint is overloaded.
+        '''
+        future = asyncio.get_running_loop().create_future()
+
+        try:
+            self.queue.put_nowait((kwargs, future))
+        except asyncio.QueueFull:
+            self.n_rejected += 1
+            raise
+
+        start = time.perf_counter()
+        try:
+            return await future
+        finally:
+            self.n_requests += 1
+            self.latencies.append(time.perf_counter() - start)
+
+    async def run(self):
+        '''Keep taking batches from the queue and evaluating them.'''
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.n_batches += 1
+            outcomes = await loop.run_in_executor(None, self.evaluate_batch, batch)
+
+            # Futures are only touched in the event loop thread
+
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    self.n_errors += 1
+                    future.set_exception(error)
+
+    def evaluate_batch(self, batch):
+        '''Evaluate a batch of (kwargs, future) and return a list of
+        (result, exception) in the same order. Calls with the same
+        argument names are evaluated together.
+        '''
+        groups = collections.defaultdict(list)
+        for i, (kwargs, _) in enumerate(batch):
+            groups[tuple(sorted(kwargs.keys()))].append(i)
+
+        outcomes = [None] * len(batch)
+
+        for names, group in groups.items():
+            # The float conversion of a batch would accept numeric strings and
+            # bools, so requests with other values are always called separately
+
+            numbers = [all(is_number(v) for v in batch[i][0].values()) for i in group]
+            batched = [i for i, n in zip(group, numbers) if n] if self.vectorized and sum(numbers) > 1 else []
+            separate = [i for i, n in zip(group, numbers) if not n] if len(batched) > 0 else group
+
+            if len(batched) > 0:
+                try:
+                    arrays = {n: np.array([batch[i][0][n] for i in batched], dtype=float) for n in names}
+                    with np.errstate(all='ignore'):
+                        results = np.broadcast_to(self.function(**arrays), len(batched))
+
+                    finite = np.isfinite(results)
+                except Exception:
+                    # Fall back to separate calls so that one bad request
+                    # does not fail the whole group
+                    results, finite = None, np.zeros(len(batched), dtype=bool)
+
+                for j, i in enumerate(batched):
+                    if finite[j]:
+                        outcomes[i] = (to_json_value(results[j]), None)
+
+                # A division by zero or an invalid value only gives inf or nan in the
+                # batched call. Call those elements separately, which raises the
+                # same errors as single requests.
+
+                separate = separate + [i for i, f in zip(batched, finite) if not f]
+
+            for i in separate:
+                outcomes[i] = self.evaluate_separately(batch[i][0])
+
+        return outcomes
+
+    def evaluate_separately(self, kwargs):
+        try:
+            return to_json_value(self.function(**kwargs)), None
+        except Exception as e:
+            return None, e
+
+    def metrics(self):
+        latencies = np.array(self.latencies) * 1000
+
+        return {'requests': self.n_requests, 'rejected': self.n_rejected, 'errors': self.n_errors,
+                'batches': self.n_batches,
+                'mean_batch_size': self.n_requests / self.n_batches if self.n_batches > 0 else 0,
+                'queue_size': self.queue.qsize(),
+                'latency_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) > 0 else None,
+                'latency_ms_p99': float(np.percentile(latencies, 99)) if len(latencies) > 0 else None}
+
+class CalculationService:
+    '''Serve the endpoint functions over HTTP/JSON.'''
+
+    def __init__(self, batch_window=0.002, max_batch_size=4096, max_queue_size=65536):
+        self.endpoints = {name: Endpoint(f, v, batch_window, max_batch_size, max_queue_size)
+                for name, (f, v) in endpoint_functions.items()}
+        self.tasks = []
+
+    async def start(self, port=None, unix_socket_path=None, host='127.0.0.1'):
+        '''Start the batching tasks and the server.
+        Return the asyncio server.
+        '''
+        self.tasks = [asyncio.create_task(e.run()) for e in self.endpoints.values()]
+
+        if unix_socket_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, unix_socket_path)
+
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def stop(self):
+        for t in self.tasks:
+            t.cancel()
+
+    async def handle_connection(self, reader, writer):
+        '''Serve HTTP/1.1 requests on one connection until it is closed.'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, value = line.decode('latin-1').split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, response = await self.handle_request(method, path, body)
+
+                # Reject inf and nan which are not valid JSON
+
+                try:
+                    payload = json.dumps(response, allow_nan=False).encode()
+                except ValueError:
+                    status = 400
+                    payload = json.dumps({'error': 'The result is not a finite number'}).encode()
+
+                writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n'.format(
+                    status, http_reasons[status], len(payload)).encode() + payload)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, path, body):
+        '''Return a tuple (status, response).'''
+        name = path.strip('/')
+
+        if method == 'GET' and name == 'metrics':
+            return 200, {n: e.metrics() for n, e in self.endpoints.items()}
+
+        if method == 'GET' and name == '':
+            return 200, {'functions': sorted(self.endpoints.keys())}
+
+        if not name in self.endpoints:
+            return 404, {'error': 'Unknown function {0}'.format(name)}
+
+        if method != 'POST':
+            return 405, {'error': 'Use POST to call a function'}
+
+        try:
+            kwargs = json.loads(body) if body else {}
+            if not isinstance(kwargs, dict):
+                raise ValueError('The request body should be a JSON object of keyword arguments')
+
+            return 200, {'result': await self.endpoints[name].call(kwargs)}
+
+        except asyncio.QueueFull:
+            return 503, {'error': 'Too many queued requests for {0}'.format(name)}
+        except Exception as e:
+            return 400, {'error': '{0}: {1}'.format(type(e).__name__, e)}
+
+async def serve(port=None, unix_socket_path=None):
+    service = CalculationService()
+    server = await service.start(port=port, unix_socket_path=unix_socket_path)
+
+    print('Serving {0} functions on {1}'.format(len(service.endpoints),
+        unix_socket_path if unix_socket_path is not None else 'http://127.0.0.1:{0}'.format(port)))
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    address = '8000' if len(sys.argv) < 2 else sys.argv[1]
+
+    if address.isdigit():
+        asyncio.run(serve(port=int(address)))
+    else:
+        asyncio.run(serve(unix_socket_path=address))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+'''A crude estimator of binding free energies of protein complexes.
+Usage:
+    ./binding_free_energy.py library_directory n_complexes
+
+The binding free energy of A + B -> AB is the sum of
+    hydrophobic: the interfacial free energy released by the buried area
+    electrostatic: the coulomb potentials of the charge pairs at the interface
+    rot_trans: the loss of rotational and translational free energy
+
+A library of complexes is a directory with one .npy file per column:
+    buried_area : (n,) buried surface area in Angstrom^2
+    charges_A, charges_B : (n, n_pairs) charges of the interface pairs in unit charge
+    charge_distances : (n, n_pairs) distances of the pairs in Angstrom
+    mass_A, mass_B : (n,) weights in Dalton
+    radius_A, radius_B : (n,) radii in Angstrom
+
+Unused charge pairs should have zero charges. Large libraries are
+memory-mapped and scored in chunks on a process pool.
+'''
+
+import os
+import sys
+import time
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cell_biology'))
+from chemical_potential import k_B, Na, average_molecule_volume, moment_of_inertia_of_ball, rotation_partion_function, translational_free_energy
+from molecular_mechanics import coulomb_potential, joule_to_kcal_per_mol
+from protein_crowding import binding_rot_trans_G
+
+
+library_columns = ['buried_area', 'charges_A', 'charges_B', 'charge_distances', 'mass_A', 'mass_B', 'radius_A', 'radius_B']
+
+energy_terms = ['hydrophobic', 'electrostatic', 'rot_trans', 'dG', 'Kd']
+
+# Effective free energy of burying protein surface at an interface. It is the
+# 25 cal/mol per Angstrom^2 of buried accessible area estimated from the transfer
+# free energies of amino acids by Chothia, Nature 248, 338 (1974). The macroscopic
+# surface tension of water in hydrophobic_interaction.water_surface_energy gives
+# about 0.105 kcal/mol/Angstrom^2, which would make the Kd of typical complexes
+# smaller than 1E-40 mol/L.
+interface_surface_energy = 0.025 # kcal/mol/Angstrom^2
+
+def rot_trans_free_energy(mass, radius, temperature=300, concentration=1):
+    '''Rotational and translational free energy of a spherical molecule
+    at the given concentration in mol/L. The mass is in Dalton and the
+    radius is in Angstrom. Return the free energy in kcal/mol.
+    '''
+    mass_kg = mass / Na / 1000
+    I = moment_of_inertia_of_ball(mass_kg, radius * 1E-10)
+
+    F_trans = translational_free_energy(mass_kg, average_molecule_volume(concentration), temperature)
+    F_rot = - k_B * temperature * np.log(rotation_partion_function(I, I, I, temperature=temperature))
+
+    return joule_to_kcal_per_mol(F_trans + F_rot)
+
+def binding_free_energy(buried_area, charges_A, charges_B, charge_distances, mass_A, mass_B, radius_A, radius_B,
+        temperature=300, dielectric_constant=20, surface_energy=interface_surface_energy, rot_trans_G=None):
+    '''Estimate the binding free energies of a library of complexes
+    given as column arrays. The standard concentration is 1 mol/L.
+
+    The hydrophobic term is - surface_energy * buried_area, where
+    surface_energy is in kcal/mol/Angstrom^2. The default is the
+    interface_surface_energy of Chothia.
+
+    If rot_trans_G is given, it is used as the rotational and
+    translational free energy loss for all complexes instead of the
+    values from the partition functions. For example, use
+    protein_crowding.binding_rot_trans_G.
+
+    Return a dictionary of arrays of the free energy terms and
+    dG in kcal/mol, and Kd in mol/L.
+    '''
+    buried_area, charges_A, charges_B, charge_distances, mass_A, mass_B, radius_A, radius_B = [np.asarray(c, dtype=float)
+            for c in (buried_area, charges_A, charges_B, charge_distances, mass_A, mass_B, radius_A, radius_B)]
+
+    hydrophobic = - surface_energy * buried_area
+
+    # Padded pairs have zero charges. Avoid dividing by a zero distance for them.
+
+    safe_distances = np.where(charges_A * charges_B != 0, charge_distances, 1)
+    electrostatic = np.sum(coulomb_potential(charges_A, charges_B, safe_distances, dielectric_constant), axis=-1)
+
+    if rot_trans_G is None:
+        radius_AB = (radius_A ** 3 + radius_B ** 3) ** (1 / 3)
+        rot_trans = (rot_trans_free_energy(mass_A + mass_B, radius_AB, temperature)
+                - rot_trans_free_energy(mass_A, radius_A, temperature) - rot_trans_free_energy(mass_B, radius_B, temperature))
+    else:
+        rot_trans = np.full_like(hydrophobic, rot_trans_G)
+
+    dG = hydrophobic + electrostatic + rot_trans
+    RT = joule_to_kcal_per_mol(k_B * temperature)
+
+    return {'hydrophobic': hydrophobic, 'electrostatic': electrostatic, 'rot_trans': rot_trans,
+            'dG': dG, 'Kd': np.exp(dG / RT)}
+
+def write_library(library_directory, **columns):
+    '''Save the columns of a library as .npy files.'''
+    os.makedirs(library_directory, exist_ok=True)
+
+    for name in library_columns:
+        np.save(os.path.join(library_directory, name + '.npy'), columns[name])
+
+def read_library(library_directory, mmap_mode='r'):
+    '''Load the columns of a library. The columns are memory-mapped by default.'''
+    return {name: np.load(os.path.join(library_directory, name + '.npy'), mmap_mode=mmap_mode) for name in library_columns}
+
+def score_library_chunk(args):
+    '''Score the complexes start:stop of a library and write the
+    results into the memory-mapped output columns.
+    '''
+    library_directory, output_directory, start, stop, kwargs = args
+
+    library = read_library(library_directory)
+    results = binding_free_energy(**{name: library[name][start:stop] for name in library_columns}, **kwargs)
+
+    for name in energy_terms:
+        output = np.load(os.path.join(output_directory, name + '.npy'), mmap_mode='r+')
+        output[start:stop] = results[name]
+        output.flush()
+
+    return stop - start
+
+def score_library(library_directory, output_directory, chunk_size=100000, n_processes=None, **kwargs):
+    '''Score a library on disk in chunks with a process pool.
+    The results are written to one .npy file per energy term in the
+    output directory, so that the memory use does not depend on the
+    size of the library. Other keyword arguments are passed to
+    binding_free_energy.
+
+    Return the memory-mapped result columns.
+    '''
+    n_complexes = len(read_library(library_directory)['buried_area'])
+
+    os.makedirs(output_directory, exist_ok=True)
+    for name in energy_terms:
+        np.lib.format.open_memmap(os.path.join(output_directory, name + '.npy'), mode='w+', dtype=float, shape=(n_complexes,))
+
+    tasks = [(library_directory, output_directory, start, min(start + chunk_size, n_complexes), kwargs)
+            for start in range(0, n_complexes, chunk_size)]
+
+    if n_processes == 1:
+        for t in tasks:
+            score_library_chunk(t)
+    else:
+        with multiprocessing.Pool(n_processes) as pool:
+            for _ in pool.imap_unordered(score_library_chunk, tasks):
+                pass
+
+    return {name: np.load(os.path.join(output_directory, name + '.npy'), mmap_mode='r') for name in energy_terms}
+
+def random_library(n_complexes, n_pairs=4, rng=np.random):
+    '''Make a random library of complexes of typical proteins.'''
+    mass_A = rng.uniform(1E4, 1E5, n_complexes)
+    mass_B = rng.uniform(1E4, 1E5, n_complexes)
+
+    # Spherical proteins with a density of 1.35 g/cm^3
+
+    radius_A = (3 * mass_A / Na / 1.35 / (4 * np.pi)) ** (1 / 3) * 1E8
+    radius_B = (3 * mass_B / Na / 1.35 / (4 * np.pi)) ** (1 / 3) * 1E8
+
+    # Standard size interfaces bury 1600 +- 400 Angstrom^2 (Lo Conte et al., J Mol Biol 285, 2177 (1999))
+
+    return {'buried_area': rng.uniform(1200, 2000, n_complexes),
+            'charges_A': rng.choice([-1., 0, 0, 1], (n_complexes, n_pairs)),
+            'charges_B': rng.choice([-1., 0, 0, 1], (n_complexes, n_pairs)),
+            'charge_distances': rng.uniform(3, 8, (n_complexes, n_pairs)),
+            'mass_A': mass_A, 'mass_B': mass_B, 'radius_A': radius_A, 'radius_B': radius_B}
+
+
+if __name__ == '__main__':
+    library_directory = sys.argv[1]
+    n_complexes = 1000000 if len(sys.argv) < 3 else int(sys.argv[2])
+
+    # Two GFP sized proteins with a standard size interface of 1600 Angstrom^2 and a salt bridge
+
+    terms = binding_free_energy([1600], [[1]], [[-1]], [[4]], [3.1E4], [3.1E4], [23.1], [23.1])
+    print('Binding of two GFP sized proteins with a surface energy of {0} kcal/mol/Angstrom^2:'.format(interface_surface_energy))
+    for name in energy_terms:
+        print('    {0} = {1:.3g}'.format(name, terms[name][0]))
+    print('    rot_trans from the partition functions = {0:.1f} kcal/mol, the estimate in protein_crowding = {1} kcal/mol'.format(
+        terms['rot_trans'][0], binding_rot_trans_G))
+
+    write_library(os.path.join(library_directory, 'library'), **random_library(n_complexes))
+
+    start = time.time()
+    results = score_library(os.path.join(library_directory, 'library'), os.path.join(library_directory, 'scores'))
+    print('\nScored {0} complexes in {1:.2f} s, median dG = {2:.1f} kcal/mol, median Kd = {3:.2E} mol/L'.format(
+        n_complexes, time.time() - start, np.median(results['dG']), np.median(results['Kd'])))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''Long range electrostatics for periodic systems.
+
+The coulomb energy of charges in a periodic box is split into a short
+range real space part, which is summed within a cutoff, and a smooth
+long range part, which is summed in the reciprocal space:
+
+    1 / r = erfc(alpha * r) / r + erf(alpha * r) / r
+
+The reciprocal part is either summed directly over the k vectors
+(Ewald summation) or calculated on a grid with FFTs (smooth particle
+mesh Ewald, Essmann et al. 1995), which scales as O(N log N).
+
+Units are the same as coulomb_potential: charges are in unit charge,
+coordinates and box lengths are in angstrom, and energies are in kcal/mol.
+'''
+
+import os
+import sys
+import time
+import itertools
+
+import numpy as np
+import scipy.fft
+import scipy.spatial
+import scipy.special
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from molecular_mechanics import coulomb_potential
+
+
+# Energy between two unit charges at 1 angstrom
+coulomb_constant = coulomb_potential(1, 1, 1) # kcal/mol * angstrom
+
+def tune_ewald_parameters(n_charges, box, accuracy=1E-5, cutoff=None, n_neighbors=100):
+    '''Choose the splitting parameter alpha so that both the real
+    space and the reciprocal space terms are truncated at the given
+    relative accuracy.
+
+    If the cutoff is not given, it is chosen such that each charge has
+    about n_neighbors charges within the cutoff, which keeps the real
+    space sum O(N). The cutoff is at most half of the box.
+
+    Return a tuple (alpha, cutoff, k_max). alpha is in 1/angstrom.
+    '''
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+
+    if cutoff is None:
+        density = n_charges / np.prod(box)
+        cutoff = (3 * n_neighbors / (4 * np.pi * density)) ** (1 / 3)
+
+    cutoff = min(cutoff, box.min() / 2)
+
+    alpha = scipy.special.erfcinv(accuracy) / cutoff
+    k_max = 2 * alpha * np.sqrt(-np.log(accuracy))
+
+    return alpha, cutoff, k_max
+
+def ewald_real_space_energy(charges, positions, box, alpha, cutoff):
+    '''Sum q1 * q2 * erfc(alpha * r) / r over the pairs within the cutoff.
+    The cutoff should not be larger than half of the box.
+    Return the energy in e^2 / angstrom.
+    '''
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+    positions = np.asarray(positions, dtype=float) % box
+
+    tree = scipy.spatial.cKDTree(positions, boxsize=box)
+    pairs = tree.query_pairs(cutoff, output_type='ndarray')
+
+    d = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+    d -= box * np.round(d / box)
+    r = np.sqrt(np.sum(d * d, axis=1))
+
+    return np.sum(charges[pairs[:, 0]] * charges[pairs[:, 1]] * scipy.special.erfc(alpha * r) / r)
+
+def ewald_self_energy(charges, box, alpha):
+    '''The self interaction of the screening charges and, for a charged
+    system, the interaction with a uniform neutralizing background.
+    Return the energy in e^2 / angstrom.
+    '''
+    volume = np.prod(np.broadcast_to(np.asarray(box, dtype=float), 3))
+
+    return (- alpha / np.sqrt(np.pi) * np.sum(charges ** 2)
+            - np.pi * np.sum(charges) ** 2 / (2 * volume * alpha ** 2))
+
+def ewald_reciprocal_energy(charges, positions, box, alpha, k_max, chunk_size=1000):
+    '''Sum the reciprocal space part directly over the k vectors.
+
+    E = 2 * pi / V * sum_k(exp(-k^2 / (4 * alpha^2)) / k^2 * |S(k)|^2)
+    S(k) = sum_j(q_j * exp(i * k * r_j))
+
+    Only half of the k vectors are used because |S(k)| = |S(-k)|.
+    The cost is O(N * n_k). Return the energy in e^2 / angstrom.
+    '''
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+    volume = np.prod(box)
+
+    n_max = np.floor(k_max * box / (2 * np.pi)).astype(int)
+    n = np.array(list(itertools.product(*[range(-m, m + 1) for m in n_max])))
+    n = n[(n[:, 0] > 0) | ((n[:, 0] == 0) & (n[:, 1] > 0)) | ((n[:, 0] == 0) & (n[:, 1] == 0) & (n[:, 2] > 0))]
+
+    k = 2 * np.pi * n / box
+    k2 = np.sum(k * k, axis=1)
+    k, k2 = k[k2 <= k_max ** 2], k2[k2 <= k_max ** 2]
+
+    energy = 0
+    for start in range(0, len(k), chunk_size):
+        phase = positions @ k[start:start + chunk_size].T
+        s2 = (charges @ np.cos(phase)) ** 2 + (charges @ np.sin(phase)) ** 2
+        kk = k2[start:start + chunk_size]
+        energy += np.sum(np.exp(-kk / (4 * alpha ** 2)) / kk * s2)
+
+    return 2 * 2 * np.pi / volume * energy
+
+def cardinal_bspline(x, order):
+    '''The cardinal B-spline M_n(x) which is nonzero for 0 < x < n.'''
+    if order == 2:
+        return np.where((x >= 0) & (x <= 2), 1 - np.abs(x - 1), 0)
+
+    return (x * cardinal_bspline(x, order - 1) + (order - x) * cardinal_bspline(x - 1, order - 1)) / (order - 1)
+
+def bspline_moduli(grid_size, order):
+    '''Return |b(m)|^2 of the smooth PME for m = 0 .. grid_size - 1.'''
+    m = np.arange(grid_size)
+    k = np.arange(order - 1)
+    denominator = np.abs(np.exp(2j * np.pi * np.outer(m, k) / grid_size) @ cardinal_bspline(k + 1.0, order)) ** 2
+
+    # Odd orders have zeros at the Nyquist frequency, use the neighbors instead
+
+    for i in np.flatnonzero(denominator < 1E-10):
+        denominator[i] = (denominator[i - 1] + denominator[(i + 1) % grid_size]) / 2
+
+    return 1 / denominator
+
+def pme_grid_size(box, k_max, oversampling=1.5):
+    '''The number of grid points in each dimension. A grid with
+    k_max * box / pi points just resolves k_max. It is oversampled
+    to reduce the B-spline interpolation error, which is below the
+    Ewald truncation error at 1E-5 to 1E-7 with splines of order 8.
+    '''
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+
+    return tuple(scipy.fft.next_fast_len(int(np.ceil(oversampling * k_max * l / np.pi)) + 1) for l in box)
+
+def pme_reciprocal_energy(charges, positions, box, alpha, grid_size, order=8, chunk_size=10000):
+    '''Calculate the reciprocal space part by the smooth particle mesh Ewald.
+    The charges are spread to a grid with B-splines of the given order
+    and the sum over the k vectors is done with a FFT of the grid.
+    Return the energy in e^2 / angstrom.
+    '''
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+    volume = np.prod(box)
+    K = np.array(grid_size)
+
+    # Spread the charges. The weight of the grid point floor(u) - j is M_n(w + j).
+    # The atoms are spread in chunks to bound the memory of the order^3 weights.
+
+    Q = np.zeros(np.prod(K))
+    j = np.arange(order)
+
+    for start in range(0, len(charges), chunk_size):
+        u = (np.asarray(positions[start:start + chunk_size], dtype=float) / box % 1) * K
+        u_floor = np.floor(u).astype(np.int64)
+
+        weights = [cardinal_bspline((u[:, d] - u_floor[:, d])[:, np.newaxis] + j, order) for d in range(3)]
+        indices = [(u_floor[:, d, np.newaxis] - j) % K[d] for d in range(3)]
+
+        flat_indices = ((indices[0][:, :, np.newaxis, np.newaxis] * K[1] + indices[1][:, np.newaxis, :, np.newaxis]) * K[2]
+                + indices[2][:, np.newaxis, np.newaxis, :])
+        flat_weights = (charges[start:start + chunk_size, np.newaxis, np.newaxis, np.newaxis] * weights[0][:, :, np.newaxis, np.newaxis]
+                * weights[1][:, np.newaxis, :, np.newaxis] * weights[2][:, np.newaxis, np.newaxis, :])
+
+        Q += np.bincount(flat_indices.ravel(), weights=flat_weights.ravel(), minlength=len(Q))
+
+    Q = Q.reshape(K)
+
+    # Sum over the reciprocal lattice vectors m
+
+    F = scipy.fft.rfftn(Q)
+
+    m = [np.fft.fftfreq(K[0], 1 / K[0]) / box[0], np.fft.fftfreq(K[1], 1 / K[1]) / box[1], np.arange(F.shape[2]) / box[2]]
+    m2 = m[0][:, np.newaxis, np.newaxis] ** 2 + m[1][np.newaxis, :, np.newaxis] ** 2 + m[2][np.newaxis, np.newaxis, :] ** 2
+    m2[0, 0, 0] = 1
+
+    B = (bspline_moduli(K[0], order)[:, np.newaxis, np.newaxis] * bspline_moduli(K[1], order)[np.newaxis, :, np.newaxis]
+            * bspline_moduli(K[2], order)[np.newaxis, np.newaxis, :F.shape[2]])
+
+    C = np.exp(-np.pi ** 2 * m2 / alpha ** 2) / m2
+    C[0, 0, 0] = 0
+
+    # The half spectrum of rfftn counts the other half twice
+
+    l = np.arange(F.shape[2])
+    half_weights = np.where((l > 0) & (2 * l != K[2]), 2, 1)
+
+    return np.sum(half_weights * C * B * (F.real ** 2 + F.imag ** 2)) / (2 * np.pi * volume)
+
+def ewald_energy(charges, positions, box, accuracy=1E-5, dielectric_constant=1, cutoff=None):
+    '''Calculate the coulomb energy of charges in a periodic box by
+    the Ewald summation. The box is a length or 3 lengths of an
+    orthorhombic box. Return the energy in kcal/mol.
+    '''
+    charges = np.asarray(charges, dtype=float)
+    alpha, cutoff, k_max = tune_ewald_parameters(len(charges), box, accuracy, cutoff)
+
+    energy = (ewald_real_space_energy(charges, positions, box, alpha, cutoff)
+            + ewald_reciprocal_energy(charges, positions, box, alpha, k_max)
+            + ewald_self_energy(charges, box, alpha))
+
+    return coulomb_constant * energy / dielectric_constant
+
+def pme_energy(charges, positions, box, accuracy=1E-5, dielectric_constant=1, cutoff=None, order=8):
+    '''Calculate the coulomb energy of charges in a periodic box by
+    the smooth particle mesh Ewald. The box is a length or 3 lengths
+    of an orthorhombic box. Return the energy in kcal/mol.
+    '''
+    charges = np.asarray(charges, dtype=float)
+    alpha, cutoff, k_max = tune_ewald_parameters(len(charges), box, accuracy, cutoff)
+
+    energy = (ewald_real_space_energy(charges, positions, box, alpha, cutoff)
+            + pme_reciprocal_energy(charges, positions, box, alpha, pme_grid_size(box, k_max), order)
+            + ewald_self_energy(charges, box, alpha))
+
+    return coulomb_constant * energy / dielectric_constant
+
+def direct_periodic_coulomb_energy(charges, positions, box, n_images=10, dielectric_constant=1):
+    '''Sum coulomb_potential over all the pairs of charges in the
+    periodic images within a sphere of n_images boxes. This is O(N^2)
+    and only for checking small systems. The box should be cubic.
+
+    The spherical sum converges to the Ewald energy plus the surface
+    term 2 * pi / (3 * V) * |sum_i(q_i * r_i)|^2 of a vacuum boundary.
+    '''
+    charges = np.asarray(charges, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    box = np.broadcast_to(np.asarray(box, dtype=float), 3)
+
+    i, j = np.triu_indices(len(charges), k=1)
+    energy = 0
+
+    for n in itertools.product(range(-n_images, n_images + 1), repeat=3):
+        if np.sum(np.square(n)) > n_images ** 2:
+            continue
+
+        shift = np.array(n) * box
+
+        # Pairs in the same image. A pair and its swap in the opposite image
+        # have the same distance, so only the half with i < j is summed.
+
+        r = np.sqrt(np.sum((positions[i] - positions[j] + shift) ** 2, axis=1))
+        energy += np.sum(coulomb_potential(charges[i], charges[j], r, dielectric_constant))
+
+        # Interactions of a charge with its own images
+
+        if any(n):
+            energy += np.sum(coulomb_potential(charges, charges, np.sqrt(np.sum(shift ** 2)), dielectric_constant)) / 2
+
+    return energy
+
+def surface_dipole_energy(charges, positions, box, dielectric_constant=1):
+    '''The surface term for a spherical sum with a vacuum boundary in kcal/mol.'''
+    volume = np.prod(np.broadcast_to(np.asarray(box, dtype=float), 3))
+    dipole = np.asarray(charges, dtype=float) @ np.asarray(positions, dtype=float)
+
+    return coulomb_constant * 2 * np.pi / (3 * volume) * np.sum(dipole ** 2) / dielectric_constant
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+
+    # Check against the direct summation for a small neutral system
+
+    box = 20.0
+    charges = np.repeat([1.0, -1.0], 10)
+    positions = rng.uniform(0, box, (len(charges), 3))
+
+    E_direct = direct_periodic_coulomb_energy(charges, positions, box) - surface_dipole_energy(charges, positions, box)
+    print('Direct summation with coulomb_potential: {0:.6f} kcal/mol'.format(E_direct))
+    print('Ewald summation: {0:.6f} kcal/mol'.format(ewald_energy(charges, positions, box, accuracy=1E-8)))
+    print('Particle mesh Ewald: {0:.6f} kcal/mol'.format(pme_energy(charges, positions, box, accuracy=1E-7)))
+
+    # Scaling of PME at the density of water (0.1 atoms per angstrom^3)
+
+    print('\nParticle mesh Ewald timing:')
+    for n in [1000, 10000, 100000]:
+        box = (n / 0.1) ** (1 / 3)
+        charges = rng.uniform(-1, 1, n)
+        charges -= charges.mean()
+        positions = rng.uniform(0, box, (n, 3))
+
+        start = time.time()
+        E = pme_energy(charges, positions, box)
+        print('    N = {0}, box = {1:.1f} angstrom, E = {2:.3E} kcal/mol, time = {3:.2f} s'.format(n, box, E, time.time() - start))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+'''Read molecular structures from PDB or XYZ files.
+Usage:
+    ./structure_reader.py structure_file cache_directory
+
+A file can have several frames (MODEL records in a PDB file or
+concatenated XYZ blocks). The frames are found by a scan of the
+memory-mapped file and each frame is parsed only when it is read.
+
+A frame is a dictionary of arrays instead of per-atom objects:
+    coordinates : (n_atoms, 3) float32 in Angstrom
+    elements : (n_atoms,) int8 index of the element in LJ_params, -1 if unknown
+    residues : (n_atoms,) int8 index of the residue name in AA_side_chain_SASA, -1 if unknown
+    residue_numbers : (n_atoms,) int32
+
+A trajectory can be converted to a cache directory of .npy files,
+which later runs memory-map without parsing or copying.
+'''
+
+import os
+import sys
+import mmap
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'statistical_and_molecular_mechanics'))
+from molecular_mechanics import LJ_params
+from hydrophobic_interaction import AA_side_chain_SASA
+
+
+element_names = list(LJ_params.keys())
+residue_names = list(AA_side_chain_SASA.keys())
+
+frame_fields = ['coordinates', 'elements', 'residues', 'residue_numbers']
+
+def name_codes(names, known_names):
+    '''Convert an array of byte strings to int8 indices in known_names.
+    Unknown names get -1.
+    '''
+    unique_names, inverse = np.unique(np.char.strip(np.char.upper(names)), return_inverse=True)
+    lookup = np.array([known_names.index(n.decode()) if n.decode() in known_names else -1 for n in unique_names], dtype=np.int8)
+
+    return lookup[inverse.ravel()] if len(unique_names) > 0 else np.zeros(0, dtype=np.int8)
+
+def element_lj_parameters(elements):
+    '''Return the arrays (r, e) of the LJ parameters of the element codes.
+    Unknown elements get nan.
+    '''
+    r = np.array([LJ_params[n]['r'] for n in element_names] + [np.nan])
+    e = np.array([LJ_params[n]['e'] for n in element_names] + [np.nan])
+
+    # Index -1 picks the nan at the end
+
+    return r[elements], e[elements]
+
+def residue_side_chain_sasa(residues):
+    '''Return the side chain SASA in Angstrom^2 of the residue codes.
+    Unknown residues get nan.
+    '''
+    return np.array([AA_side_chain_SASA[n] for n in residue_names] + [np.nan])[residues]
+
+def fixed_width_column(lines, start, stop):
+    '''Get the columns start:stop of an (n_lines, width) uint8 array as byte strings.'''
+    return np.ascontiguousarray(lines[:, start:stop]).view('S{0}'.format(stop - start)).ravel()
+
+def parse_pdb_frame(data):
+    '''Parse the ATOM and HETATM records of one frame of a PDB file.'''
+    records = [l for l in data.split(b'\n') if l[:6] in (b'ATOM  ', b'HETATM')]
+    lines = np.array(records, dtype='S80').view(np.uint8).reshape(len(records), 80)
+
+    coordinates = np.stack([fixed_width_column(lines, s, s + 8).astype(np.float32) for s in (30, 38, 46)], axis=1)
+
+    # Use the element column if it exists, otherwise guess from the atom name
+
+    elements = np.char.strip(fixed_width_column(lines, 76, 78))
+    atom_names = np.char.lstrip(fixed_width_column(lines, 12, 16), b' 0123456789')
+    elements = np.where(np.char.str_len(elements) > 0, elements, np.char.ljust(atom_names, 1).astype('S1'))
+
+    residue_numbers = fixed_width_column(lines, 22, 26)
+
+    return {'coordinates': coordinates.reshape(-1, 3),
+            'elements': name_codes(elements, element_names),
+            'residues': name_codes(fixed_width_column(lines, 17, 20), residue_names),
+            'residue_numbers': residue_numbers.astype(np.int32) if len(records) > 0 else np.zeros(0, dtype=np.int32)}
+
+def parse_xyz_frame(data):
+    '''Parse one frame of an XYZ file. XYZ files have no residues.'''
+    lines = data.split(b'\n')
+    n_atoms = int(lines[0])
+    fields = np.array([l.split()[:4] for l in lines[2:2 + n_atoms]], dtype='S32').reshape(n_atoms, 4)
+
+    return {'coordinates': fields[:, 1:].astype(np.float32),
+            'elements': name_codes(fields[:, 0], element_names),
+            'residues': -np.ones(n_atoms, dtype=np.int8),
+            'residue_numbers': np.zeros(n_atoms, dtype=np.int32)}
+
+class StructureReader:
+    '''Lazy reader of the frames of a PDB or XYZ file.
+
+    The file is memory-mapped and only scanned for the frame
+    boundaries when it is opened. Frames are parsed on access.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower().lstrip('.')
+
+        if not self.format in ['pdb', 'xyz']:
+            raise ValueError('Unknown structure file format {0}'.format(self.format))
+
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.frame_offsets = self.index_pdb_frames() if self.format == 'pdb' else self.index_xyz_frames()
+
+    def index_pdb_frames(self):
+        '''Return a list of (start, stop) byte offsets of the models.
+        A file without MODEL records has one frame.
+        '''
+        offsets = []
+        start = self.data.find(b'MODEL ')
+
+        if start < 0:
+            return [(0, len(self.data))]
+
+        while start >= 0:
+            stop = self.data.find(b'ENDMDL', start)
+            stop = len(self.data) if stop < 0 else stop
+            offsets.append((start, stop))
+            start = self.data.find(b'\nMODEL ', stop)
+
+        return offsets
+
+    def index_xyz_frames(self):
+        '''Return a list of (start, stop) byte offsets of the XYZ blocks.'''
+        offsets = []
+        start = 0
+
+        while start < len(self.data):
+            line_end = self.data.find(b'\n', start)
+            line_end = len(self.data) if line_end < 0 else line_end
+            if self.data[start:line_end].strip() == b'':
+                break
+
+            # Skip the count line, the comment line and the atom lines
+
+            stop = start
+            for i in range(int(self.data[start:line_end]) + 2):
+                stop = self.data.find(b'\n', stop) + 1
+                if stop == 0:
+                    stop = len(self.data)
+                    break
+
+            offsets.append((start, stop))
+            start = stop
+
+        return offsets
+
+    def __len__(self):
+        return len(self.frame_offsets)
+
+    def __getitem__(self, i):
+        start, stop = self.frame_offsets[i]
+        data = self.data[start:stop]
+
+        return parse_pdb_frame(data) if self.format == 'pdb' else parse_xyz_frame(data)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+def write_cache(path, cache_directory):
+    '''Convert a structure file to a cache directory. All the frames
+    should have the same atoms. The coordinates are saved as an array
+    of (n_frames, n_atoms, 3) which is filled one frame at a time.
+    '''
+    reader = StructureReader(path)
+    os.makedirs(cache_directory, exist_ok=True)
+
+    first = reader[0]
+    for name in ['elements', 'residues', 'residue_numbers']:
+        np.save(os.path.join(cache_directory, name + '.npy'), first[name])
+
+    coordinates = np.lib.format.open_memmap(os.path.join(cache_directory, 'coordinates.npy'), mode='w+',
+            dtype=np.float32, shape=(len(reader),) + first['coordinates'].shape)
+
+    for i, frame in enumerate(reader):
+        if frame['coordinates'].shape != first['coordinates'].shape:
+            raise ValueError('Frame {0} has {1} atoms but frame 0 has {2} atoms.'.format(
+                i, len(frame['coordinates']), len(first['coordinates'])))
+        coordinates[i] = frame['coordinates']
+
+    coordinates.flush()
+    reader.close()
+
+def load_cache(cache_directory):
+    '''Memory-map a cache directory. The coordinates have the shape
+    (n_frames, n_atoms, 3) and the other fields are per atom.
+    '''
+    return {name: np.load(os.path.join(cache_directory, name + '.npy'), mmap_mode='r') for name in frame_fields}
+
+
+if __name__ == '__main__':
+    structure_file = sys.argv[1]
+    cache_directory = sys.argv[2]
+
+    reader = StructureReader(structure_file)
+    frame = reader[0]
+    print('{0} has {1} frames and {2} atoms in the first frame'.format(structure_file, len(reader), len(frame['coordinates'])))
+
+    known = frame['elements'] >= 0
+    print('Elements: ' + ', '.join('{0} = {1}'.format(n, np.sum(frame['elements'] == i)) for i, n in enumerate(element_names))
+            + ', unknown = {0}'.format(np.sum(~known)))
+
+    # Sum the side chain SASA of each residue once
+
+    first_atoms = np.concatenate([[True], np.diff(frame['residue_numbers']) != 0])
+    print('Total side chain SASA of the residues = {0:.0f} Angstrom^2'.format(np.nansum(residue_side_chain_sasa(frame['residues'][first_atoms]))))
+
+    write_cache(structure_file, cache_directory)
+    cache = load_cache(cache_directory)
+    print('Cached the coordinates with shape {0} in {1}'.format(cache['coordinates'].shape, cache_directory))